@@ -1,3 +1,4 @@
+import os
 import time
 from pyramid.authentication import BasicAuthAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
@@ -5,19 +6,29 @@ from pyramid.config import Configurator
 from pyramid.security import ALL_PERMISSIONS, unauthenticated_userid
 from pyramid.security import Allow
 from pyramid.security import Authenticated
+from sqlalchemy import bindparam
+from sqlalchemy.orm import sessionmaker
 from waitress import serve
 
 import db.create
-from db import Engine
-from event_persister import BackgroundEventPersister
-from models import DBSession, Base, User, ApiKey
+from db import Engine, Bakery
+from event_persister import BackgroundEventPersister, last_persisted_sequence
+from models import DBSession, Base, User, ApiKey, Order
 # In reality this should be cached, ignore for this implementation
-from order_book import Events
+from order_book import Events, OrderBookOrder
+from serialization import Serializer, JsonRenderer, write_order, write_order_book_order
+
+
+api_key_query = Bakery(lambda session: session.query(ApiKey))
+api_key_query += lambda q: q.filter(ApiKey.id == bindparam('key_id')).filter(ApiKey.key == bindparam('key'))
+
+user_by_key_query = Bakery(lambda session: session.query(User))
+user_by_key_query += lambda q: q.filter(ApiKey.user_id == User.id).filter(ApiKey.id == bindparam('key_id'))
 
 
 def check_credentials(username, password, request):
     session = DBSession()
-    key = session.query(ApiKey).filter(ApiKey.id == username).filter(ApiKey.key == password).first()
+    key = api_key_query(session).params(key_id=username, key=password).first()
 
     if key is not None:
         return []
@@ -28,7 +39,7 @@ def get_user(request):
 
     key_id = unauthenticated_userid(request)
     if key_id is not None:
-        return session.query(User).filter(ApiKey.user_id == User.id).filter(ApiKey.id == key_id).first()
+        return user_by_key_query(session).params(key_id=key_id).first()
 
 
 class Root:
@@ -45,15 +56,26 @@ def main():
     # Just init the database at the start for simplicity
     db.create.init()
 
+    # Continue event numbering after the last applied event, otherwise the persister would skip the new events
+    session = sessionmaker(bind=Engine)()
+    Events.start_after(last_persisted_sequence(session))
+    session.close()
+
     p = BackgroundEventPersister(Events)
     p.start()
 
     DBSession.configure(bind=Engine)
     Base.metadata.bind = Engine
 
+    Serializer.add_writer(Order, write_order)
+    Serializer.add_writer(OrderBookOrder, write_order_book_order)
+
     with Configurator() as config:
         config.include('pyramid_tm')
 
+        # Replaces the default json renderer used by the views
+        config.add_renderer('json', JsonRenderer(Serializer))
+
         config.add_request_method(get_user, 'user', reify=True)
 
         config.add_route('place_order', '/orders', request_method='POST')
@@ -67,7 +89,8 @@ def main():
         config.set_root_factory(lambda request: Root())
 
         app = config.make_wsgi_app()
-    serve(app, host='0.0.0.0', port=8888)
+    # Keep the number of threads below the connection pool size (the event persister holds one connection as well)
+    serve(app, host='0.0.0.0', port=8888, threads=int(os.environ.get('APP_THREADS', '8')))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,189 @@
+from decimal import Context, Decimal, MAX_EMAX, MAX_PREC, MIN_EMIN
+
+import numpy as np
+
+# Scaling by a power of ten never rounds in this context
+EXACT = Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+FIFO = 'fifo'
+PRO_RATA = 'pro_rata'
+
+
+def uncross(buy_orders, sell_orders, allocation=FIFO):
+    """Find the clearing price of a call auction and allocate fills between crossing orders.
+
+    Orders on each side must be given in time priority. Returns a tuple of the clearing price and a list of
+    (buy order, sell order, amount) matches. The clearing price is None when the orders do not cross. Orders are not
+    modified.
+    """
+    check_allocation(allocation)
+
+    price, volume = clearing_price([(o.price, o.amount_to_match()) for o in buy_orders],
+                                   [(o.price, o.amount_to_match()) for o in sell_orders])
+
+    return price, allocate(buy_orders, sell_orders, price, volume, allocation)
+
+
+def check_allocation(allocation):
+    if allocation not in (FIFO, PRO_RATA):
+        raise Exception('Invalid allocation: {}'.format(allocation))
+
+
+def clearing_price(buy_depth, sell_depth):
+    """Find the price with the maximal executable volume from (price, amount) pairs of both sides.
+
+    A price can appear more than once, so whole price levels can be passed instead of single orders. Ties are broken
+    by the minimal imbalance and then by the lowest price. Returns a tuple of the clearing price and the volume
+    executable at it, (None, 0) when the sides do not cross.
+    """
+    if len(buy_depth) == 0 or len(sell_depth) == 0:
+        return None, Decimal(0)
+
+    depth = buy_depth + sell_depth
+    amounts, amount_scale = _to_ints([amount for _, amount in depth])
+    prices, price_scale = _to_ints([price for price, _ in depth])
+
+    # Prices are only compared, so the rank of the price level stands in for the price itself
+    levels, prices = np.unique(prices, return_inverse=True)
+    buy_count = len(buy_depth)
+
+    buy_depth = np.zeros(len(levels), dtype=amounts.dtype)
+    np.add.at(buy_depth, prices[:buy_count], amounts[:buy_count])
+    sell_depth = np.zeros(len(levels), dtype=amounts.dtype)
+    np.add.at(sell_depth, prices[buy_count:], amounts[buy_count:])
+
+    # Buyers at a price accept every lower price, sellers every higher one
+    demand = np.cumsum(buy_depth[::-1])[::-1]
+    supply = np.cumsum(sell_depth)
+    volume = np.minimum(demand, supply)
+
+    max_volume = volume.max()
+    if max_volume == 0:
+        return None, Decimal(0)
+
+    candidates = np.flatnonzero(volume == max_volume)
+    price = candidates[np.argmin(np.abs(demand - supply)[candidates])]
+
+    return _to_decimal(levels[price], price_scale), _to_decimal(max_volume, amount_scale)
+
+
+def allocate(buy_orders, sell_orders, price, volume, allocation=FIFO):
+    """Allocate the volume executed at the clearing price between the orders that accept the price.
+
+    Orders on each side must be given in time priority, they are filled in price priority first and time priority
+    second. Orders that do not accept the price are ignored. Returns a list of (buy order, sell order, amount) matches.
+    """
+    check_allocation(allocation)
+
+    if price is None:
+        return []
+
+    buy_orders = [o for o in buy_orders if o.price >= price]
+    sell_orders = [o for o in sell_orders if o.price <= price]
+    orders = buy_orders + sell_orders
+
+    amounts, amount_scale = _to_ints([o.amount_to_match() for o in orders] + [volume])
+    amounts, volume = amounts[:-1], amounts[-1]
+    prices, _ = _to_ints([o.price for o in orders])
+    prices = np.unique(prices, return_inverse=True)[1].astype(np.int64)
+    buy_count = len(buy_orders)
+
+    buy_amounts, sell_amounts = amounts[:buy_count], amounts[buy_count:]
+    buy_prices, sell_prices = prices[:buy_count], prices[buy_count:]
+
+    # Price priority first, time priority (position in the input) second
+    buy_priority = np.lexsort((np.arange(buy_count), -buy_prices))
+    sell_priority = np.lexsort((np.arange(len(sell_orders)), sell_prices))
+
+    allocate_fills = _allocate_fifo if allocation == FIFO else _allocate_pro_rata
+    buy_fills = allocate_fills(buy_amounts[buy_priority], buy_prices[buy_priority], volume)
+    sell_fills = allocate_fills(sell_amounts[sell_priority], sell_prices[sell_priority], volume)
+
+    buys, sells, amounts = _pair_fills(buy_priority, buy_fills, sell_priority, sell_fills)
+
+    # Fills repeat the same few amounts, each distinct amount is converted once
+    decimals = {amount: _to_decimal(amount, amount_scale) for amount in set(amounts)}
+
+    return [(buy_orders[b], sell_orders[s], decimals[amount]) for b, s, amount in zip(buys, sells, amounts)]
+
+
+def _allocate_fifo(amounts, prices, volume):
+    before = np.cumsum(amounts) - amounts
+    return np.clip(volume - before, 0, amounts)
+
+
+def _allocate_pro_rata(amounts, prices, volume):
+    """Fill better priced levels completely and share the rest of the volume pro-rata inside the marginal level."""
+    fills = _allocate_fifo(amounts, prices, volume)
+
+    # Orders are sorted by price, so every level is a contiguous run
+    level_starts = np.flatnonzero(np.concatenate(([True], prices[1:] != prices[:-1])))
+    level_totals = np.add.reduceat(amounts, level_starts)
+    level_fills = np.add.reduceat(fills, level_starts)
+
+    marginal = np.flatnonzero((level_fills > 0) & (level_fills < level_totals))
+    if len(marginal) == 0:
+        return fills
+
+    level = marginal[0]
+    level_end = level_starts[level + 1] if level + 1 < len(level_starts) else len(amounts)
+    in_level = slice(level_starts[level], level_end)
+    level_amounts = amounts[in_level]
+    remaining = int(level_fills[level])
+    total = int(level_totals[level])
+
+    # Python integers avoid overflowing int64 while multiplying amounts
+    shares = np.array([a * remaining // total for a in level_amounts.tolist()], dtype=amounts.dtype)
+    # Units lost to rounding go to the earliest orders
+    shares += _allocate_fifo(level_amounts - shares, prices[in_level], remaining - shares.sum())
+
+    fills[in_level] = shares
+    return fills
+
+
+def _pair_fills(buy_index, buy_fills, sell_index, sell_fills):
+    """Split the filled volume into matches between buy and sell orders, walking both sides in priority order.
+
+    Returns lists of buy indexes, sell indexes and matched amounts.
+    """
+    buy_filled = buy_fills > 0
+    sell_filled = sell_fills > 0
+    buy_index, buy_fills = buy_index[buy_filled], buy_fills[buy_filled]
+    sell_index, sell_fills = sell_index[sell_filled], sell_fills[sell_filled]
+
+    buy_ends = np.cumsum(buy_fills)
+    sell_ends = np.cumsum(sell_fills)
+
+    ends = np.union1d(buy_ends, sell_ends)
+    starts = np.concatenate(([0], ends[:-1]))
+
+    buys = buy_index[np.searchsorted(buy_ends, starts, side='right')]
+    sells = sell_index[np.searchsorted(sell_ends, starts, side='right')]
+
+    return buys.tolist(), sells.tolist(), (ends - starts).tolist()
+
+
+def _to_ints(values):
+    """Convert decimals to fixed point integers using the smallest scale that keeps them exact.
+
+    Every distinct value is converted once, orders share few prices and amounts. Values are int64 when they fit,
+    otherwise exact Python integers (slower, but never overflows).
+    """
+    distinct = set(values)
+    scale = max(0, -min(v.as_tuple().exponent for v in distinct))
+    converted = {v: int(v.scaleb(scale, EXACT)) for v in distinct}
+
+    try:
+        result = np.fromiter(map(converted.__getitem__, values), dtype=np.int64, count=len(values))
+    except OverflowError:
+        return np.array([converted[v] for v in values], dtype=object), scale
+
+    # Cumulative sums of the values have to fit as well
+    if int(np.abs(result).max()) * len(values) > np.iinfo(np.int64).max:
+        return np.array([converted[v] for v in values], dtype=object), scale
+
+    return result, scale
+
+
+def _to_decimal(value, scale):
+    return Decimal(int(value)).scaleb(-scale, EXACT)
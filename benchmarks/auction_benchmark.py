@@ -0,0 +1,99 @@
+"""Compare uncrossing a call auction with feeding the same orders to continuous matching.
+
+Two scenarios are measured: an empty book (opening auction) and a book that already holds resting orders which do not
+cross each other (eg. an auction after a volatility halt). Only adding the orders and uncrossing is timed.
+
+Run from the repository root: python -m benchmarks.auction_benchmark [order count]
+"""
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+from order_book import OrderBook, OrderBookOrder, SequencedQueue
+
+
+def generate_orders(count, seed=42):
+    rnd = random.Random(seed)
+    orders = []
+    for i in range(count):
+        order_type = rnd.choice(['buy', 'sell'])
+        amount = Decimal(rnd.randint(1, 1000)).scaleb(-2)
+        # Wide overlapping price ranges like in a pre-open book, so a large share of the orders cross
+        center = 95 if order_type == 'buy' else 105
+        price = Decimal(rnd.randint((center - 20) * 100, (center + 20) * 100)).scaleb(-2)
+        orders.append(OrderBookOrder(i + 1, order_type, amount, price))
+    return orders
+
+
+def generate_resting_orders(count, seed=7):
+    rnd = random.Random(seed)
+    orders = []
+    for i in range(count):
+        order_type = rnd.choice(['buy', 'sell'])
+        amount = Decimal(rnd.randint(1, 1000)).scaleb(-2)
+        # Buys below and sells above 75, only the most aggressive new orders reach them
+        if order_type == 'buy':
+            price = Decimal(rnd.randint(5000, 7499)).scaleb(-2)
+        else:
+            price = Decimal(rnd.randint(7500, 13000)).scaleb(-2)
+        orders.append(OrderBookOrder(-i - 1, order_type, amount, price))
+    return orders
+
+
+def copy_orders(orders):
+    return [OrderBookOrder(o.id, o.type, o.amount, o.price) for o in orders]
+
+
+def new_order_book(resting_orders):
+    # Same queue as the shared order book, events are stamped with a sequence
+    order_book = OrderBook(SequencedQueue())
+    for order in copy_orders(resting_orders):
+        order_book.add_order(order)
+    return order_book
+
+
+def run_continuous(order_book, orders):
+    for order in orders:
+        order_book.add_order(order)
+
+
+def run_auction(order_book, orders, allocation):
+    order_book.start_auction()
+    for order in orders:
+        order_book.add_order(order)
+    order_book.uncross(allocation)
+
+
+def measure(fn, orders, resting_orders, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        order_book = new_order_book(resting_orders)
+        orders_copy = copy_orders(orders)
+        start = timeit.default_timer()
+        fn(order_book, orders_copy)
+        timings.append(timeit.default_timer() - start)
+    return min(timings)
+
+
+def report(name, orders, resting_orders):
+    continuous = measure(run_continuous, orders, resting_orders)
+    fifo = measure(lambda b, o: run_auction(b, o, 'fifo'), orders, resting_orders)
+    pro_rata = measure(lambda b, o: run_auction(b, o, 'pro_rata'), orders, resting_orders)
+
+    print('{} ({} orders, {} resting)'.format(name, len(orders), len(resting_orders)))
+    print('  continuous:       {:.3f}s'.format(continuous))
+    print('  auction fifo:     {:.3f}s ({:.1f}x)'.format(fifo, continuous / fifo))
+    print('  auction pro-rata: {:.3f}s ({:.1f}x)'.format(pro_rata, continuous / pro_rata))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    orders = generate_orders(count)
+
+    report('empty book', orders, [])
+    report('resting book', orders, generate_resting_orders(count))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,85 @@
+import logging
+import os
+import threading
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext import baked
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_URL = 'mysql://root:test@db:3306/exchange?use_unicode=1'
+
+
+class PoolCheckoutStats:
+    """Time spent checking out connections from the pool, including opening new connections when the pool grows."""
+
+    def __init__(self, slow_threshold):
+        self.logger = logging.getLogger('PoolCheckoutStats')
+        self.lock = threading.Lock()
+        self.slow_threshold = slow_threshold
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, checkout_time):
+        with self.lock:
+            self.count += 1
+            self.total_time += checkout_time
+            self.max_time = max(self.max_time, checkout_time)
+
+        if checkout_time >= self.slow_threshold:
+            self.logger.warning('Checking out a database connection took %.3fs', checkout_time)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'total_time': self.total_time,
+                'max_time': self.max_time,
+                'average_time': self.total_time / self.count if self.count else 0.0,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """Queue pool that records checkout times, slow_checkout is passed through create_engine like other pool options."""
+
+    def __init__(self, creator, slow_checkout=1.0, **kw):
+        super().__init__(creator, **kw)
+        self.checkout_stats = PoolCheckoutStats(slow_checkout)
+
+    def recreate(self):
+        # Stats are shared with the recreated pool (eg. after a disconnect)
+        pool = super().recreate()
+        pool.checkout_stats = self.checkout_stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_stats.record(time.perf_counter() - start)
+
+
+def create_engine_from_config(config=os.environ):
+    """Create the engine with pool settings sized for the waitress thread pool, overridable by environment variables."""
+    engine = create_engine(
+        config.get('DB_URL', DEFAULT_URL),
+        encoding='utf8',
+        poolclass=InstrumentedQueuePool,
+        pool_size=int(config.get('DB_POOL_SIZE', '10')),
+        max_overflow=int(config.get('DB_POOL_MAX_OVERFLOW', '10')),
+        pool_timeout=float(config.get('DB_POOL_TIMEOUT', '30')),
+        # MySQL closes idle connections after wait_timeout (8 hours by default)
+        pool_recycle=int(config.get('DB_POOL_RECYCLE', '3600')),
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        slow_checkout=float(config.get('DB_POOL_SLOW_CHECKOUT', '1.0')),
+    )
+
+    return engine
+
+
+Engine = create_engine_from_config()
 
-Engine = create_engine('mysql://root:test@db:3306/exchange?use_unicode=1', encoding='utf8')
+# Hot queries are baked, so they are built and compiled only once
+Bakery = baked.bakery()
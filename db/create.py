@@ -45,6 +45,11 @@ def init():
 
     session.commit()
 
+    if session.query(EventOffset).filter(EventOffset.name == PERSISTER_OFFSET).first() is None:
+        session.add(EventOffset(name=PERSISTER_OFFSET, sequence=0))
+
+    session.commit()
+
 
 if __name__ == '__main__':
     init()
@@ -1,75 +1,157 @@
 import logging
 import sys
+import time
 from queue import Queue
 from threading import Thread
 
+from sqlalchemy import bindparam
 from sqlalchemy.orm import Session, sessionmaker
 
-from db import Engine
-from models import Order, Match, Balance
+from db import Engine, Bakery
+from models import Order, Match, Balance, EventOffset, PERSISTER_OFFSET
+from serialization import Serializer
+
+# Every event is applied with the same few statements, build them once and let the connection cache their compiled
+# form instead of building and compiling ORM queries for each event
+order_query = Bakery(lambda session: session.query(Order))
+order_query += lambda q: q.filter(Order.id == bindparam('order_id'))
+
+update_order_status = Order.__table__.update().\
+    where(Order.id == bindparam('order_id')).\
+    values(status=bindparam('new_status'))
+
+refund_balance = Balance.__table__.update().\
+    where(Balance.user_id == bindparam('balance_user_id')).\
+    where(Balance.currency == bindparam('balance_currency')).\
+    values(amount=Balance.amount + bindparam('refund'))
+
+insert_match = Match.__table__.insert()
+
+offset_query = EventOffset.__table__.select().where(EventOffset.name == bindparam('offset_name'))
+
+update_offset = EventOffset.__table__.update().\
+    where(EventOffset.name == bindparam('offset_name')).\
+    values(sequence=bindparam('new_sequence'))
+
+
+def last_persisted_sequence(session: Session):
+    offset = session.execute(offset_query, {'offset_name': PERSISTER_OFFSET}).first()
+    if offset is None:
+        return 0
+
+    return offset.sequence
+
+
+def describe_event(event):
+    """Event in the same JSON format as responses, repr if it can not be serialized (logging must not fail)."""
+    try:
+        return Serializer.dumps(event)
+    except Exception:
+        return repr(event)
 
 
 class BackgroundEventPersister(Thread):
 
-    def __init__(self, events: Queue):
+    def __init__(self, events: Queue, max_restarts=5, backoff=0.5, max_backoff=30):
         super().__init__(daemon=True)
         self.logger = logging.getLogger('BackgroundEventPersister')
         self.events = events
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
 
     def run(self):
-        session = sessionmaker(bind=Engine)()
+        pending = None
+        # Shared by restarted persisters, the statements are the same
+        compiled_cache = {}
+        attempt = 0
+        while attempt <= self.max_restarts:
+            session = sessionmaker(bind=Engine.execution_options(compiled_cache=compiled_cache))()
+
+            p = None
+            try:
+                p = EventPersister(session, self.events, pending)
+                started_at = p.last_sequence
+                p.run()
+            except Exception:
+                # The event that failed was already taken from the queue, hand it over to the next persister
+                if p is not None:
+                    pending = p.pending
 
-        p = EventPersister(session, self.events)
-        try:
-            p.run()
-        except Exception:
-            self.logger.exception("Persister failed")
-            # Do no crash recovery, persister could be restarted n times to try to recover
-            sys.exit(1)
+                    # Events were applied since the last restart, so this is a new failure and not a repeated one
+                    if p.last_sequence > started_at:
+                        attempt = 0
+
+                self.logger.exception("Persister failed on event %s, attempt %s of %s",
+                                      describe_event(pending), attempt + 1, self.max_restarts + 1)
+            finally:
+                session.close()
+
+            # Failures are often transient (eg. a match for an order whose transaction is not committed yet)
+            if attempt < self.max_restarts:
+                time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+
+            attempt += 1
+
+        # Events that were applied are recorded by their sequence, so a new persister will not apply them again
+        sys.exit(1)
 
 
 class EventPersister:
-    def __init__(self, session: Session, events: Queue):
+    def __init__(self, session: Session, events: Queue, pending=None):
         self.session = session
         self.events = events
+        self.pending = pending
+        self.last_sequence = last_persisted_sequence(session)
 
     def run(self):
         while True:
-            event = self.events.get()
-            event_name = event.get('name')
+            if self.pending is None:
+                self.pending = self.events.get()
 
             try:
-                self.__handle_event(event_name, event)
+                self.__apply_event(self.pending)
             except Exception:
                 self.session.rollback()
                 raise
 
-    def __handle_event(self, event_name, event):
-        if event_name == 'cancelled':
-            order = self.session.query(Order).filter(Order.id == event['order_id']).first()
-            order.status = 'cancelled'
+            self.pending = None
 
-            self.session.query(Balance).\
-                filter(Balance.user_id == order.user_id).\
-                filter(Balance.currency == order.required_currency()).\
-                update({Balance.amount: Balance.amount + event['remaining_amount']})
+    def __apply_event(self, event):
+        sequence = event['sequence']
+        if sequence <= self.last_sequence:
+            # Already applied by a previous persister
+            return
 
-            self.session.commit()
-        elif event_name == 'complete':
-            self.session.query(Order).filter(Order.id == event['order_id']). \
-                update({Order.status: 'complete'})
-            self.session.commit()
-        elif event_name == 'match':
-            match = Match(amount=event['amount'],
-                          order_id=event['order_id'],
-                          matched_order_id=event['matched_order_id'])
-            reverse_match = Match(amount=event['amount'],
-                                  order_id=event['matched_order_id'],
-                                  matched_order_id=event['order_id'])
+        self.__handle_event(event.get('name'), event)
+
+        # Offset is updated in the same transaction as the event changes, so each event is applied exactly once
+        self.session.execute(update_offset, {'offset_name': PERSISTER_OFFSET, 'new_sequence': sequence})
+        self.session.commit()
 
-            self.session.add(match)
-            self.session.add(reverse_match)
+        self.last_sequence = sequence
 
-            self.session.commit()
+    def __handle_event(self, event_name, event):
+        if event_name == 'cancelled':
+            order = order_query(self.session).params(order_id=event['order_id']).first()
+
+            self.session.execute(update_order_status, {'order_id': order.id, 'new_status': 'cancelled'})
+            self.session.execute(refund_balance, {
+                'balance_user_id': order.user_id,
+                'balance_currency': order.required_currency(),
+                'refund': event['remaining_amount'],
+            })
+        elif event_name == 'complete':
+            self.session.execute(update_order_status, {'order_id': event['order_id'], 'new_status': 'complete'})
+        elif event_name == 'match':
+            self.session.execute(insert_match, [{
+                'amount': event['amount'],
+                'order_id': event['order_id'],
+                'matched_order_id': event['matched_order_id'],
+            }, {
+                'amount': event['amount'],
+                'order_id': event['matched_order_id'],
+                'matched_order_id': event['order_id'],
+            }])
         else:
             raise Exception('Unrecognized event name: {}'.format(event_name))
@@ -5,7 +5,8 @@ from sqlalchemy.orm import relationship, scoped_session, sessionmaker
 from sqlalchemy import *
 from zope.sqlalchemy import ZopeTransactionExtension
 
-DBSession = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+# Large responses are streamed after the transaction is committed, loaded objects must stay readable
+DBSession = scoped_session(sessionmaker(extension=ZopeTransactionExtension(), expire_on_commit=False))
 
 Base = declarative_base()
 
@@ -40,9 +41,14 @@ class ApiKey(Base):
 # TODO: index
 class Order(Base):
     __tablename__ = 'orders'
-    __table_args__ = default_table_args
+    __table_args__ = (
+        UniqueConstraint('user_id', 'client_order_id', name='uq_orders_user_id_client_order_id'),
+        default_table_args,
+    )
 
     id = Column(BigInteger, primary_key=True)
+    # Binary collation, client order ids differing only in case are different ids (like in RecentClientOrderIds)
+    client_order_id = Column(String(64, collation='utf8_bin'), nullable=True)
     status = Column(String(32, collation='utf8_unicode_ci'), nullable=False)
     user_id = Column(BigInteger, ForeignKey(User.id, ondelete="CASCADE"), nullable=False)
     type = Column(String(32, collation='utf8_unicode_ci'), nullable=False)
@@ -97,3 +103,17 @@ class Balance(Base):
         return "<Balance(id='{}', currency='{}', amount='{}')>".format(
             self.id, self.currency, self.amount)
 
+
+# Name of the offset row tracking the last event applied by the event persister
+PERSISTER_OFFSET = 'persister'
+
+
+class EventOffset(Base):
+    __tablename__ = 'event_offsets'
+    __table_args__ = default_table_args
+
+    name = Column(String(32, collation='utf8_unicode_ci'), primary_key=True)
+    sequence = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<EventOffset(name='{}', sequence='{}')>".format(self.name, self.sequence)
@@ -5,6 +5,8 @@ from queue import Queue
 
 from sortedcontainers import SortedDict
 
+import auction
+
 
 class OrderBookOrder:
     def __init__(self, id, type, amount, price):
@@ -38,22 +40,84 @@ class OrderBookOrder:
             and self.matched_amount == other.matched_amount
 
 
+class SequencedQueue(Queue):
+    """Event queue that stamps every event with a monotonically increasing sequence number.
+
+    The sequence is assigned while holding the queue mutex, so the numbering always matches the order in which
+    events are consumed. Persisted sequence numbers let a restarted consumer skip already applied events.
+    """
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.sequence = 0
+
+    def start_after(self, sequence):
+        with self.mutex:
+            self.sequence = max(self.sequence, sequence)
+
+    def put_many(self, events):
+        """Put all events at once, taking the lock and waking consumers once instead of once per event.
+
+        Events are stamped with consecutive sequence numbers. The queue size is not limited for bulk puts.
+        """
+        if len(events) == 0:
+            return
+
+        with self.not_full:
+            sequence = self.sequence
+            for event in events:
+                sequence += 1
+                event['sequence'] = sequence
+            self.sequence = sequence
+
+            self.queue.extend(events)
+            self.unfinished_tasks += len(events)
+            self.not_empty.notify(len(events))
+
+    def _put(self, event):
+        self.sequence += 1
+        event['sequence'] = self.sequence
+        super()._put(event)
+
+
 class OrderBookSide:
     def __init__(self, asc, events: Queue):
         self.asc = asc
         self.events = events
         self.orders_map = {}
         self.levels_map = SortedDict()
+        # Remaining amount of all orders at a price level
+        self.level_amounts = {}
+        # Price of the first level to match against, kept up to date so non-crossing orders skip walking the levels
+        self.best_price = None
 
     def add_order(self, order):
         self.levels_map.setdefault(order.price, []).append(order)
         self.orders_map[order.id] = order
+        level_amount = self.level_amounts.get(order.price)
+        if level_amount is None:
+            self.level_amounts[order.price] = order.amount_to_match()
+        else:
+            self.level_amounts[order.price] = level_amount + order.amount_to_match()
+
+        if self.best_price is None or self.__compare_price(self.best_price, order.price):
+            self.best_price = order.price
+
+    def best(self):
+        """Best price and the remaining amount at that price, None if the side is empty."""
+        if self.best_price is None:
+            return None
+
+        return self.best_price, self.level_amounts[self.best_price]
 
     def match_order(self, order):
+        if self.best_price is None or not self.__compare_price(order.price, self.best_price):
+            return order
+
         remove_list = []
         for level in self.__iterate_levels():
             if self.__compare_price(order.price, level):
-                self.__match_orders(order, self.levels_map[level], remove_list)
+                self.__match_orders(order, level, self.levels_map[level], remove_list)
                 if order.is_matched():
                     self.events.put({
                         'name': 'complete',
@@ -69,9 +133,10 @@ class OrderBookSide:
 
         return order
 
-    def __match_orders(self, order, orders, remove_list):
+    def __match_orders(self, order, level, orders, remove_list):
         for o in orders:
             transferred_amount = o.transfer_amount(order)
+            self.level_amounts[level] -= transferred_amount
             self.events.put({
                 'name': 'match',
                 'amount': transferred_amount,
@@ -92,9 +157,21 @@ class OrderBookSide:
     def __remove_order(self, order):
         level = self.levels_map[order.price]
         level.remove(order)
+        self.orders_map.pop(order.id, None)
+        self.level_amounts[order.price] -= order.amount_to_match()
 
         if len(level) == 0:
             self.levels_map.pop(order.price)
+            self.level_amounts.pop(order.price)
+
+            if order.price == self.best_price:
+                self.__update_best_price()
+
+    def __update_best_price(self):
+        if len(self.levels_map) == 0:
+            self.best_price = None
+        else:
+            self.best_price = self.levels_map.peekitem(0 if self.asc else -1)[0]
 
     def __compare_price(self, order_price, book_price):
         if self.asc:
@@ -124,6 +201,64 @@ class OrderBookSide:
     def orders(self):
         return [o for l in self.levels_map for o in self.levels_map[l]]
 
+    def crossing_levels(self, price):
+        """Prices of the levels that an order of the other side at the given price would match."""
+        if self.asc:
+            return self.levels_map.irange(maximum=price)
+        else:
+            return self.levels_map.irange(minimum=price)
+
+    def crossing_depth(self, price):
+        """(price, remaining amount) pairs of the levels an order of the other side at the given price would match."""
+        return [(l, self.level_amounts[l]) for l in self.crossing_levels(price)]
+
+    def crossing_orders(self, price):
+        """Orders that an order of the other side at the given price would match."""
+        return [o for l in self.crossing_levels(price) for o in self.levels_map[l]]
+
+    def add_orders(self, orders):
+        """Add many orders in time priority at once, levels are inserted in bulk."""
+        levels = {}
+        for order in orders:
+            levels.setdefault(order.price, []).append(order)
+            self.orders_map[order.id] = order
+
+        new_levels = {}
+        for price, level_orders in levels.items():
+            amount = sum(o.amount_to_match() for o in level_orders)
+            level = self.levels_map.get(price)
+            if level is None:
+                new_levels[price] = level_orders
+                self.level_amounts[price] = amount
+            else:
+                level.extend(level_orders)
+                self.level_amounts[price] += amount
+
+        self.levels_map.update(new_levels)
+        self.__update_best_price()
+
+    def update_crossing_levels(self, price):
+        """Update the levels crossing the price after their orders were matched outside of match_order.
+
+        Fully matched orders are removed and the remaining amounts of the levels are recomputed.
+        """
+        for level_price in list(self.crossing_levels(price)):
+            level = []
+            for o in self.levels_map[level_price]:
+                if o.is_matched():
+                    self.orders_map.pop(o.id)
+                else:
+                    level.append(o)
+
+            if len(level) == 0:
+                self.levels_map.pop(level_price)
+                self.level_amounts.pop(level_price)
+            else:
+                self.levels_map[level_price] = level
+                self.level_amounts[level_price] = sum(o.amount_to_match() for o in level)
+
+        self.__update_best_price()
+
 
 class OrderBook:
     def __init__(self, events: Queue):
@@ -131,28 +266,134 @@ class OrderBook:
         # parallel while walking the order book. More threads contending for locks could just make things worse.
         self.lock = threading.Lock()
 
+        self.events = events
         self.buy_side = OrderBookSide(asc=False, events=events)
         self.sell_side = OrderBookSide(asc=True, events=events)
 
+        # Orders collected during a call auction, None when matching continuously
+        self.auction_orders = None
+
     def add_order(self, order):
+        if order.type not in ['buy', 'sell']:
+            raise Exception('Invalid order type: {}'.format(order.type))
+
+        with self.lock:
+            if self.auction_orders is not None:
+                self.auction_orders[order.id] = order
+            else:
+                self.__match_order(order)
+
+    def __match_order(self, order):
         if order.type == 'buy':
-            with self.lock:
-                self.sell_side.match_order(order)
-                if not order.is_matched():
-                    self.buy_side.add_order(order)
-        elif order.type == 'sell':
-            with self.lock:
-                self.buy_side.match_order(order)
-                if not order.is_matched():
-                    self.sell_side.add_order(order)
+            self.sell_side.match_order(order)
+            if not order.is_matched():
+                self.buy_side.add_order(order)
         else:
-            raise Exception('Invalid order type: {}'.format(order.kind))
+            self.buy_side.match_order(order)
+            if not order.is_matched():
+                self.sell_side.add_order(order)
+
+    def start_auction(self):
+        """Start collecting orders without matching them until the auction is uncrossed."""
+        with self.lock:
+            if self.auction_orders is None:
+                self.auction_orders = {}
+
+    def uncross(self, allocation=auction.FIFO):
+        """Match the collected and resting orders at a single clearing price and resume continuous matching.
+
+        Resting orders have time priority over the collected ones. Orders that are not fully matched are added back
+        to the book. Returns the clearing price or None if no orders crossed.
+        """
+        with self.lock:
+            if self.auction_orders is None:
+                raise Exception('Order book is not in an auction')
+
+            collected = list(self.auction_orders.values())
+            collected_buys = [o for o in collected if o.type == 'buy']
+            collected_sells = [o for o in collected if o.type == 'sell']
+
+            # Resting orders do not cross each other, so only levels reachable by a collected order can trade. Whole
+            # levels are enough to find the price, only orders that accept it are allocated.
+            buy_depth = [(o.price, o.amount_to_match()) for o in collected_buys]
+            if collected_sells:
+                buy_depth += self.buy_side.crossing_depth(min(o.price for o in collected_sells))
+            sell_depth = [(o.price, o.amount_to_match()) for o in collected_sells]
+            if collected_buys:
+                sell_depth += self.sell_side.crossing_depth(max(o.price for o in collected_buys))
+
+            # Nothing is modified until the uncross succeeds, on failure the auction keeps collecting
+            auction.check_allocation(allocation)
+            price, volume = auction.clearing_price(buy_depth, sell_depth)
+            matches = []
+            if price is not None:
+                matches = auction.allocate(self.buy_side.crossing_orders(price) + collected_buys,
+                                           self.sell_side.crossing_orders(price) + collected_sells,
+                                           price, volume, allocation)
+            self.auction_orders = None
+
+            events = []
+            for buy_order, sell_order, amount in matches:
+                buy_order.matched_amount += amount
+                sell_order.matched_amount += amount
+                events.append({
+                    'name': 'match',
+                    'amount': amount,
+                    'order_id': buy_order.id,
+                    'matched_order_id': sell_order.id,
+                })
+
+                if buy_order.is_matched():
+                    events.append({
+                        'name': 'complete',
+                        'order_id': buy_order.id,
+                    })
+                if sell_order.is_matched():
+                    events.append({
+                        'name': 'complete',
+                        'order_id': sell_order.id,
+                    })
+
+            # The shared sequenced queue takes all events at once, other queues one by one
+            if isinstance(self.events, SequencedQueue):
+                self.events.put_many(events)
+            else:
+                for event in events:
+                    self.events.put(event)
+
+            # Only touched levels of the book change. Remaining orders can not cross, any crossing pair would allow a
+            # larger volume at another price.
+            if price is not None:
+                self.buy_side.update_crossing_levels(price)
+                self.sell_side.update_crossing_levels(price)
+            self.buy_side.add_orders([o for o in collected_buys if not o.is_matched()])
+            self.sell_side.add_orders([o for o in collected_sells if not o.is_matched()])
+
+            return price
 
     def cancel_order_by_id(self, order_id):
         with self.lock:
+            if self.auction_orders is not None:
+                order = self.auction_orders.pop(order_id, None)
+                if order is not None:
+                    self.events.put({
+                        'name': 'cancelled',
+                        'order_id': order.id,
+                        'remaining_amount': order.amount_to_match(),
+                    })
+                    return
+
             self.buy_side.cancel_order_by_id(order_id)
             self.sell_side.cancel_order_by_id(order_id)
 
+    def best_bid_offer(self):
+        """Best bid and offer as a tuple of (price, remaining amount) pairs, a pair is None if the side is empty.
+
+        Orders collected during an auction are not included.
+        """
+        with self.lock:
+            return self.buy_side.best(), self.sell_side.best()
+
     def buy_orders(self):
         return self.buy_side.orders()
 
@@ -160,5 +401,5 @@ class OrderBook:
         return self.sell_side.orders()
 
 
-Events = Queue()
+Events = SequencedQueue()
 SharedOrderBook = OrderBook(Events)
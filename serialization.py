@@ -0,0 +1,98 @@
+import json
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+
+
+def _default(o):
+    if isinstance(o, Decimal):
+        return str(o)
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(o).__name__))
+
+
+def _string(value):
+    if value is None:
+        return 'null'
+
+    return encode_basestring_ascii(value)
+
+
+class JsonSerializer:
+    """Decimal aware JSON serializer with writers for types that are serialized often.
+
+    A writer turns an object directly into JSON text without building an intermediate dict. Writers are used for top
+    level values and items of top level lists, anything else goes through the standard encoder. Decimals are always
+    written as strings.
+    """
+
+    def __init__(self, chunk_size=500):
+        self.writers = {}
+        self.chunk_size = chunk_size
+        self.encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+    def add_writer(self, type, writer):
+        self.writers[type] = writer
+
+    def dumps(self, value):
+        writer = self.writers.get(value.__class__)
+        if writer is not None:
+            return writer(value)
+
+        if isinstance(value, (list, tuple)):
+            return '[' + ','.join(self.dumps(v) for v in value) + ']'
+
+        return self.encoder.encode(value)
+
+    def iter_dumps(self, values):
+        """Encode a sequence as a JSON array, yielding chunks of chunk_size items."""
+        separator = '['
+        for i in range(0, len(values), self.chunk_size):
+            yield separator + ','.join(self.dumps(v) for v in values[i:i + self.chunk_size])
+            separator = ','
+
+        yield '[]' if separator == '[' else ']'
+
+
+class JsonRenderer:
+    """Pyramid renderer factory, lists longer than stream_threshold are streamed instead of built in memory."""
+
+    def __init__(self, serializer: JsonSerializer, stream_threshold=1000):
+        self.serializer = serializer
+        self.stream_threshold = stream_threshold
+
+    def __call__(self, info):
+        def _render(value, system):
+            request = system.get('request')
+            if request is None:
+                return self.serializer.dumps(value)
+
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = 'application/json'
+
+            if isinstance(value, (list, tuple)) and len(value) > self.stream_threshold:
+                response.app_iter = (chunk.encode('ascii') for chunk in self.serializer.iter_dumps(value))
+                return None
+
+            return self.serializer.dumps(value)
+
+        return _render
+
+
+def write_match(match):
+    return '{{"id":{},"matched_order_id":{},"amount":"{}"}}'.format(match.id, match.matched_order_id, match.amount)
+
+
+def write_order(order):
+    return '{{"id":{},"client_order_id":{},"type":{},"amount":"{}","price":"{}","status":{},"matches":[{}]}}'.format(
+        order.id, _string(order.client_order_id), _string(order.type), order.amount, order.price,
+        _string(order.status), ','.join(write_match(m) for m in order.matches))
+
+
+def write_order_book_order(order):
+    return '{{"id":{},"type":{},"amount":"{}","price":"{}","matched_amount":"{}"}}'.format(
+        order.id, _string(order.type), order.amount, order.price, order.matched_amount)
+
+
+# Shared by the responses and the persister event log, so orders and events have one wire format
+Serializer = JsonSerializer()
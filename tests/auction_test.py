@@ -0,0 +1,67 @@
+import unittest
+from decimal import Decimal
+
+import auction
+from order_book import OrderBookOrder
+
+
+class AuctionTest(unittest.TestCase):
+
+    def test_orders_that_do_not_cross_are_not_matched(self):
+        price, matches = auction.uncross([OrderBookOrder(1, 'buy', Decimal('10'), Decimal('4'))],
+                                         [OrderBookOrder(2, 'sell', Decimal('10'), Decimal('5'))])
+
+        self.assertIsNone(price)
+        self.assertEqual([], matches)
+
+    def test_clearing_price_maximizes_the_executed_volume(self):
+        buy_orders = [
+            OrderBookOrder(1, 'buy', Decimal('10'), Decimal('5.2')),
+            OrderBookOrder(2, 'buy', Decimal('20'), Decimal('5.0')),
+            OrderBookOrder(3, 'buy', Decimal('30'), Decimal('4.8')),
+        ]
+        sell_orders = [
+            OrderBookOrder(4, 'sell', Decimal('15'), Decimal('4.7')),
+            OrderBookOrder(5, 'sell', Decimal('15'), Decimal('5.0')),
+            OrderBookOrder(6, 'sell', Decimal('30'), Decimal('5.1')),
+        ]
+
+        price, matches = auction.uncross(buy_orders, sell_orders)
+
+        self.assertEqual(Decimal('5.0'), price)
+        self.assertEqual([(1, 4, Decimal('10')), (2, 4, Decimal('5')), (2, 5, Decimal('15'))],
+                         [(b.id, s.id, amount) for b, s, amount in matches])
+
+    def test_marginal_level_is_allocated_pro_rata(self):
+        buy_orders = [
+            OrderBookOrder(1, 'buy', Decimal('10'), Decimal('5')),
+            OrderBookOrder(2, 'buy', Decimal('30'), Decimal('5')),
+        ]
+        sell_orders = [OrderBookOrder(3, 'sell', Decimal('20'), Decimal('5'))]
+
+        price, matches = auction.uncross(buy_orders, sell_orders, auction.PRO_RATA)
+
+        self.assertEqual(Decimal('5'), price)
+        self.assertEqual([(1, 3, Decimal('5')), (2, 3, Decimal('15'))],
+                         [(b.id, s.id, amount) for b, s, amount in matches])
+
+    def test_rounding_remainder_of_pro_rata_goes_to_the_earliest_orders(self):
+        buy_orders = [
+            OrderBookOrder(1, 'buy', Decimal('1'), Decimal('5')),
+            OrderBookOrder(2, 'buy', Decimal('1'), Decimal('5')),
+            OrderBookOrder(3, 'buy', Decimal('1'), Decimal('5')),
+        ]
+        sell_orders = [OrderBookOrder(4, 'sell', Decimal('2'), Decimal('5'))]
+
+        price, matches = auction.uncross(buy_orders, sell_orders, auction.PRO_RATA)
+
+        self.assertEqual([(1, 4, Decimal('1')), (2, 4, Decimal('1'))],
+                         [(b.id, s.id, amount) for b, s, amount in matches])
+
+    def test_partially_matched_orders_use_the_remaining_amount(self):
+        sell_order = OrderBookOrder(2, 'sell', Decimal('10'), Decimal('5'))
+        sell_order.matched_amount = Decimal('4')
+
+        price, matches = auction.uncross([OrderBookOrder(1, 'buy', Decimal('10'), Decimal('5'))], [sell_order])
+
+        self.assertEqual([(1, 2, Decimal('6'))], [(b.id, s.id, amount) for b, s, amount in matches])
@@ -0,0 +1,58 @@
+import os
+import unittest
+
+# Never connect to the configured database from tests
+os.environ.setdefault('DB_URL', 'sqlite://')
+
+from db import InstrumentedQueuePool, create_engine_from_config
+
+
+class CreateEngineFromConfigTest(unittest.TestCase):
+
+    def test_defaults(self):
+        pool = create_engine_from_config({'DB_URL': 'sqlite://'}).pool
+
+        self.assertIsInstance(pool, InstrumentedQueuePool)
+        self.assertEqual(10, pool.size())
+        self.assertEqual(10, pool._max_overflow)
+        self.assertEqual(30, pool._timeout)
+        self.assertEqual(3600, pool._recycle)
+        self.assertTrue(pool._pre_ping)
+        self.assertEqual(1.0, pool.checkout_stats.slow_threshold)
+
+    def test_pool_settings_are_parsed(self):
+        pool = create_engine_from_config({
+            'DB_URL': 'sqlite://',
+            'DB_POOL_SIZE': '4',
+            'DB_POOL_MAX_OVERFLOW': '2',
+            'DB_POOL_TIMEOUT': '5.5',
+            'DB_POOL_RECYCLE': '600',
+            'DB_POOL_PRE_PING': 'False',
+            'DB_POOL_SLOW_CHECKOUT': '0.25',
+        }).pool
+
+        self.assertEqual(4, pool.size())
+        self.assertEqual(2, pool._max_overflow)
+        self.assertEqual(5.5, pool._timeout)
+        self.assertEqual(600, pool._recycle)
+        self.assertFalse(pool._pre_ping)
+        self.assertEqual(0.25, pool.checkout_stats.slow_threshold)
+
+    def test_invalid_integer_setting_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_engine_from_config({'DB_URL': 'sqlite://', 'DB_POOL_SIZE': 'ten'})
+
+    def test_checkouts_are_recorded(self):
+        engine = create_engine_from_config({'DB_URL': 'sqlite://', 'DB_POOL_PRE_PING': 'true'})
+
+        engine.connect().close()
+        engine.connect().close()
+
+        snapshot = engine.pool.checkout_stats.snapshot()
+        self.assertEqual(2, snapshot['count'])
+        self.assertGreaterEqual(snapshot['max_time'], snapshot['average_time'])
+
+    def test_stats_are_shared_with_the_recreated_pool(self):
+        pool = create_engine_from_config({'DB_URL': 'sqlite://'}).pool
+
+        self.assertIs(pool.checkout_stats, pool.recreate().checkout_stats)
@@ -0,0 +1,132 @@
+import os
+import queue
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+# Never connect to the configured database from tests
+os.environ.setdefault('DB_URL', 'sqlite://')
+
+from sqlalchemy import BigInteger, create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from event_persister import BackgroundEventPersister, EventPersister, describe_event, last_persisted_sequence
+from models import Base, User, Balance, Order, Match, EventOffset, PERSISTER_OFFSET
+
+
+@compiles(BigInteger, 'sqlite')
+def compile_big_integer(element, compiler, **kw):
+    # SQLite only autoincrements INTEGER primary keys
+    return 'INTEGER'
+
+
+def create_sqlite_engine():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def create_collations(connection, record):
+        connection.create_collation('utf8_unicode_ci', lambda a, b: (a > b) - (a < b))
+        connection.create_collation('utf8_bin', lambda a, b: (a > b) - (a < b))
+
+    return engine
+
+
+class EventPersisterTest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_sqlite_engine()
+        Base.metadata.create_all(engine)
+
+        self.engine = engine
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(User(id=1, name='user-1'))
+        self.session.add(Balance(id=1, user_id=1, currency='ETH', amount=Decimal('10')))
+        self.session.add(Order(id=1, user_id=1, status='pending', type='sell', amount=Decimal('5'),
+                               price=Decimal('2')))
+        self.session.add(EventOffset(name=PERSISTER_OFFSET, sequence=0))
+        self.session.commit()
+
+        self.events = queue.Queue()
+
+    def test_events_are_applied_and_sequence_is_stored(self):
+        self.events.put({'name': 'complete', 'order_id': 1, 'sequence': 1})
+
+        self.run_until_stopped(EventPersister(self.session, self.events), last_sequence=1)
+
+        self.assertEqual('complete', self.session.query(Order).get(1).status)
+        self.assertEqual(1, last_persisted_sequence(self.session))
+
+    def test_already_applied_sequence_is_skipped(self):
+        self.session.query(EventOffset).update({EventOffset.sequence: 5})
+        self.session.commit()
+
+        self.events.put({'name': 'match', 'amount': Decimal('1'), 'order_id': 1, 'matched_order_id': 2,
+                         'sequence': 5})
+
+        self.run_until_stopped(EventPersister(self.session, self.events), last_sequence=5)
+
+        self.assertEqual(0, self.session.query(Match).count())
+        self.assertEqual(5, last_persisted_sequence(self.session))
+
+    def test_pending_event_is_retried_by_the_next_persister(self):
+        self.events.put({'name': 'cancelled', 'order_id': 2, 'remaining_amount': Decimal('3'), 'sequence': 1})
+
+        failed = EventPersister(self.session, self.events)
+        # Order 2 does not exist yet (eg. its transaction is not committed)
+        with self.assertRaises(AttributeError):
+            failed.run()
+
+        self.assertEqual(0, last_persisted_sequence(self.session))
+
+        self.session.add(Order(id=2, user_id=1, status='pending', type='sell', amount=Decimal('3'),
+                               price=Decimal('2')))
+        self.session.commit()
+
+        self.run_until_stopped(EventPersister(self.session, self.events, failed.pending), last_sequence=1)
+
+        self.session.expire_all()
+        self.assertEqual('cancelled', self.session.query(Order).get(2).status)
+        self.assertEqual(Decimal('13'), self.session.query(Balance).get(1).amount)
+        self.assertEqual(1, last_persisted_sequence(self.session))
+
+    def test_restart_budget_is_reset_after_progress(self):
+        # Order 2 is committed while the persister backs off, then the persister fails on a new event
+        self.events.put({'name': 'cancelled', 'order_id': 2, 'remaining_amount': Decimal('3'), 'sequence': 1})
+        self.events.put({'name': 'complete', 'order_id': 1, 'sequence': 2})
+        self.events.put({'name': 'stop', 'sequence': 3})
+
+        def commit_order(seconds):
+            if self.session.query(Order).get(2) is None:
+                self.session.add(Order(id=2, user_id=1, status='pending', type='sell', amount=Decimal('3'),
+                                       price=Decimal('2')))
+                self.session.commit()
+
+        persister = BackgroundEventPersister(self.events, max_restarts=1)
+        with mock.patch('event_persister.Engine', self.engine), \
+                mock.patch('event_persister.time.sleep', commit_order), \
+                self.assertLogs('BackgroundEventPersister') as logs, \
+                self.assertRaises(SystemExit):
+            persister.run()
+
+        # Without the reset the failure on the new event would have used up both attempts
+        self.assertEqual(['attempt 1 of 2', 'attempt 1 of 2', 'attempt 2 of 2'],
+                         [r.getMessage()[-len('attempt 1 of 2'):] for r in logs.records])
+        self.assertEqual(2, last_persisted_sequence(self.session))
+
+    def test_events_are_described_in_the_wire_format(self):
+        self.assertEqual('{"name":"match","amount":"1.5","sequence":3}',
+                         describe_event({'name': 'match', 'amount': Decimal('1.5'), 'sequence': 3}))
+
+        # Unserializable values must not make the failure log fail
+        self.assertEqual("{'name': 'match', 'amount': {1}}", describe_event({'name': 'match', 'amount': {1}}))
+
+    def run_until_stopped(self, persister, last_sequence):
+        # Unrecognized events make the persister fail, which ends the otherwise endless loop
+        self.events.put({'name': 'stop', 'sequence': last_sequence + 1})
+
+        with self.assertRaises(Exception):
+            persister.run()
+
+        self.assertEqual('stop', persister.pending['name'])
@@ -2,7 +2,7 @@ import queue
 import unittest
 from decimal import Decimal
 
-from order_book import OrderBookOrder, OrderBook
+from order_book import OrderBookOrder, OrderBook, SequencedQueue
 
 
 class OrderBookTest(unittest.TestCase):
@@ -165,6 +165,184 @@ class OrderBookTest(unittest.TestCase):
         self.assertEqual([OrderBookOrder(2, 'sell', Decimal('20'), Decimal('1.1')),
                           OrderBookOrder(4, 'sell', Decimal('40'), Decimal('1.2'))], self.order_book.sell_orders())
 
+    def test_orders_are_not_matched_during_an_auction(self):
+        self.order_book.start_auction()
+
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('3')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('10'), Decimal('4')))
+
+        self.assertEqual([], self.order_book.buy_orders())
+        self.assertEqual([], self.order_book.sell_orders())
+        self.assertTrue(self.events.empty())
+
+    def test_auction_is_uncrossed_at_a_single_price(self):
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')))
+
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('15'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(3, 'sell', Decimal('10'), Decimal('4')))
+        self.order_book.add_order(OrderBookOrder(4, 'buy', Decimal('5'), Decimal('3')))
+
+        self.assertEqual(Decimal('5'), self.order_book.uncross())
+
+        self.assertEqual({
+            'name': 'match',
+            'amount': Decimal('10'),
+            'order_id': 2,
+            'matched_order_id': 3,
+        }, self.events.get(block=False))
+        self.assertEqual({
+            'name': 'complete',
+            'order_id': 3,
+        }, self.events.get(block=False))
+        self.assertEqual({
+            'name': 'match',
+            'amount': Decimal('5'),
+            'order_id': 2,
+            'matched_order_id': 1,
+        }, self.events.get(block=False))
+        self.assertEqual({
+            'name': 'complete',
+            'order_id': 2,
+        }, self.events.get(block=False))
+        self.assertTrue(self.events.empty())
+
+        self.assertEqual([OrderBookOrder(4, 'buy', Decimal('5'), Decimal('3'))], self.order_book.buy_orders())
+        self.assertEqual([self.with_matched_amount(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')), Decimal('5'))],
+                         self.order_book.sell_orders())
+
+    def test_orders_are_matched_continuously_after_an_auction(self):
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')))
+        self.assertIsNone(self.order_book.uncross())
+
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('10'), Decimal('5')))
+
+        self.assertEqual([], self.order_book.buy_orders())
+        self.assertEqual([], self.order_book.sell_orders())
+        self.expect_event('match')
+
+    def test_resting_order_filled_by_several_collected_orders_is_removed(self):
+        self.order_book.add_order(OrderBookOrder(1, 'buy', Decimal('6'), Decimal('8')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('2'), Decimal('8')))
+
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(3, 'sell', Decimal('2'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(4, 'sell', Decimal('4'), Decimal('8')))
+
+        self.assertEqual(Decimal('8'), self.order_book.uncross())
+
+        self.assertEqual([OrderBookOrder(2, 'buy', Decimal('2'), Decimal('8'))], self.order_book.buy_orders())
+        self.assertEqual([], self.order_book.sell_orders())
+        self.assertEqual(((Decimal('8'), Decimal('2')), None), self.order_book.best_bid_offer())
+
+    def test_resting_orders_out_of_reach_are_kept_after_uncross(self):
+        self.order_book.add_order(OrderBookOrder(1, 'buy', Decimal('10'), Decimal('2')))
+        self.order_book.add_order(OrderBookOrder(2, 'sell', Decimal('10'), Decimal('9')))
+        self.order_book.add_order(OrderBookOrder(3, 'sell', Decimal('10'), Decimal('6')))
+
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(4, 'buy', Decimal('15'), Decimal('6')))
+        self.order_book.add_order(OrderBookOrder(5, 'sell', Decimal('10'), Decimal('5')))
+
+        self.assertEqual(Decimal('6'), self.order_book.uncross())
+
+        self.assertEqual([OrderBookOrder(1, 'buy', Decimal('10'), Decimal('2'))], self.order_book.buy_orders())
+        self.assertEqual([self.with_matched_amount(OrderBookOrder(3, 'sell', Decimal('10'), Decimal('6')), Decimal('5')),
+                          OrderBookOrder(2, 'sell', Decimal('10'), Decimal('9'))], self.order_book.sell_orders())
+        self.assertEqual(((Decimal('2'), Decimal('10')), (Decimal('6'), Decimal('5'))), self.order_book.best_bid_offer())
+
+    def test_failed_uncross_keeps_the_auction_orders(self):
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('10'), Decimal('5')))
+
+        with self.assertRaises(Exception):
+            self.order_book.uncross(allocation='invalid')
+
+        self.assertEqual([], self.order_book.buy_orders())
+        self.assertEqual(Decimal('5'), self.order_book.uncross())
+        self.expect_event('match')
+
+    def test_auction_with_amounts_out_of_the_int64_range_is_uncrossed(self):
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('1E+20'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('0.0000000000000000000001'), Decimal('5')))
+
+        self.assertEqual(Decimal('5'), self.order_book.uncross())
+
+        self.assertEqual({
+            'name': 'match',
+            'amount': Decimal('0.0000000000000000000001'),
+            'order_id': 2,
+            'matched_order_id': 1,
+        }, self.events.get(block=False))
+        self.assertEqual({
+            'name': 'complete',
+            'order_id': 2,
+        }, self.events.get(block=False))
+        self.assertEqual([], self.order_book.buy_orders())
+        self.assertEqual([1], [o.id for o in self.order_book.sell_orders()])
+
+    def test_cancelled_order_is_removed_from_the_auction(self):
+        self.order_book.start_auction()
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('10'), Decimal('5')))
+
+        self.order_book.cancel_order_by_id(1)
+
+        self.assertEqual({
+            'name': 'cancelled',
+            'order_id': 1,
+            'remaining_amount': Decimal('10'),
+        }, self.events.get(block=False))
+
+        self.assertIsNone(self.order_book.uncross())
+        self.assertEqual([OrderBookOrder(2, 'buy', Decimal('10'), Decimal('5'))], self.order_book.buy_orders())
+
+    def test_best_bid_offer_of_an_empty_order_book(self):
+        self.assertEqual((None, None), self.order_book.best_bid_offer())
+
+    def test_best_bid_offer_aggregates_the_best_levels(self):
+        self.order_book.add_order(OrderBookOrder(1, 'buy', Decimal('10'), Decimal('1.0')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('20'), Decimal('0.9')))
+        self.order_book.add_order(OrderBookOrder(3, 'buy', Decimal('30'), Decimal('1.0')))
+        self.order_book.add_order(OrderBookOrder(4, 'sell', Decimal('40'), Decimal('1.2')))
+        self.order_book.add_order(OrderBookOrder(5, 'sell', Decimal('50'), Decimal('1.1')))
+
+        self.assertEqual(((Decimal('1.0'), Decimal('40')), (Decimal('1.1'), Decimal('50'))),
+                         self.order_book.best_bid_offer())
+
+    def test_best_bid_offer_is_updated_after_matching(self):
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('3.5')))
+        self.order_book.add_order(OrderBookOrder(2, 'sell', Decimal('30'), Decimal('3.5')))
+        self.order_book.add_order(OrderBookOrder(3, 'sell', Decimal('20'), Decimal('3.6')))
+
+        self.order_book.add_order(OrderBookOrder(4, 'buy', Decimal('15'), Decimal('3.5')))
+        self.assertEqual((None, (Decimal('3.5'), Decimal('25'))), self.order_book.best_bid_offer())
+
+        self.order_book.add_order(OrderBookOrder(5, 'buy', Decimal('30'), Decimal('3.5')))
+        self.assertEqual(((Decimal('3.5'), Decimal('5')), (Decimal('3.6'), Decimal('20'))),
+                         self.order_book.best_bid_offer())
+
+    def test_best_bid_offer_is_updated_after_cancelling(self):
+        self.order_book.add_order(OrderBookOrder(1, 'buy', Decimal('10'), Decimal('1.0')))
+        self.order_book.add_order(OrderBookOrder(2, 'buy', Decimal('20'), Decimal('0.9')))
+
+        self.order_book.cancel_order_by_id(1)
+
+        self.assertEqual(((Decimal('0.9'), Decimal('20')), None), self.order_book.best_bid_offer())
+
+    def test_matched_order_can_not_be_cancelled(self):
+        self.order_book.add_order(OrderBookOrder(1, 'sell', Decimal('10'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(2, 'sell', Decimal('10'), Decimal('5')))
+        self.order_book.add_order(OrderBookOrder(3, 'buy', Decimal('10'), Decimal('5')))
+
+        self.order_book.cancel_order_by_id(1)
+
+        self.assertEqual([OrderBookOrder(2, 'sell', Decimal('10'), Decimal('5'))], self.order_book.sell_orders())
+        self.assertEqual((None, (Decimal('5'), Decimal('10'))), self.order_book.best_bid_offer())
+
     def expect_event(self, event_name):
         self.assertEqual(event_name, self.events.get(block=False)['name'])
 
@@ -173,3 +351,40 @@ class OrderBookTest(unittest.TestCase):
         order.matched_amount = matcher_amount
         return order
 
+
+class SequencedQueueTest(unittest.TestCase):
+
+    def test_events_are_numbered_in_order(self):
+        events = SequencedQueue()
+        order_book = OrderBook(events)
+
+        order_book.add_order(OrderBookOrder(1, 'sell', Decimal('500'), Decimal('5')))
+        order_book.add_order(OrderBookOrder(2, 'buy', Decimal('500'), Decimal('5')))
+
+        self.assertEqual([1, 2, 3], [events.get(block=False)['sequence'] for _ in range(3)])
+
+    def test_numbering_continues_after_the_given_sequence(self):
+        events = SequencedQueue()
+        events.start_after(41)
+
+        events.put({'name': 'complete', 'order_id': 1})
+
+        self.assertEqual({
+            'name': 'complete',
+            'order_id': 1,
+            'sequence': 42,
+        }, events.get(block=False))
+
+    def test_uncross_puts_events_in_bulk(self):
+        events = SequencedQueue()
+        events.put({'name': 'complete', 'order_id': 9})
+        order_book = OrderBook(events)
+
+        order_book.start_auction()
+        order_book.add_order(OrderBookOrder(1, 'sell', Decimal('500'), Decimal('5')))
+        order_book.add_order(OrderBookOrder(2, 'buy', Decimal('500'), Decimal('5')))
+        order_book.uncross()
+
+        self.assertEqual(4, events.unfinished_tasks)
+        self.assertEqual([(1, 'complete'), (2, 'match'), (3, 'complete'), (4, 'complete')],
+                         [(e['sequence'], e['name']) for e in [events.get(block=False) for _ in range(4)]])
@@ -0,0 +1,116 @@
+import json
+import unittest
+from decimal import Decimal
+
+from models import Order, Match
+from order_book import OrderBookOrder
+from serialization import JsonSerializer, JsonRenderer, write_order, write_order_book_order
+
+
+class JsonSerializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.serializer = JsonSerializer(chunk_size=2)
+        self.serializer.add_writer(OrderBookOrder, write_order_book_order)
+        self.serializer.add_writer(Order, write_order)
+
+    def test_decimals_are_written_as_strings(self):
+        self.assertEqual('{"name":"match","amount":"1.50"}',
+                         self.serializer.dumps({'name': 'match', 'amount': Decimal('1.50')}))
+
+    def test_writer_is_used_for_list_items(self):
+        order = OrderBookOrder(1, 'buy', Decimal('10'), Decimal('3.5'))
+        order.matched_amount = Decimal('2')
+
+        self.assertEqual([{
+            'id': 1,
+            'type': 'buy',
+            'amount': '10',
+            'price': '3.5',
+            'matched_amount': '2',
+        }], json.loads(self.serializer.dumps([order])))
+
+    def test_arrays_are_encoded_in_chunks(self):
+        orders = [OrderBookOrder(i, 'sell', Decimal('1'), Decimal('2')) for i in range(5)]
+
+        chunks = list(self.serializer.iter_dumps(orders))
+
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(self.serializer.dumps(orders), ''.join(chunks))
+
+    def test_empty_array_is_encoded(self):
+        self.assertEqual(['[]'], list(self.serializer.iter_dumps([])))
+
+    def test_order_writer_matches_the_dict_format(self):
+        order = Order(id=1, client_order_id='a "quoted" \u00e9', status='pending', type='buy',
+                      amount=Decimal('10.000000'), price=Decimal('3.500000'))
+        order.matches = [Match(id=7, matched_order_id=2, amount=Decimal('1.250000')),
+                         Match(id=8, matched_order_id=3, amount=Decimal('2.000000'))]
+        no_client_order_id = Order(id=2, client_order_id=None, status='complete', type='sell',
+                                   amount=Decimal('1'), price=Decimal('2'))
+
+        # Format the list_orders view used to build before the writers
+        expected = [{
+            'id': o.id,
+            'client_order_id': o.client_order_id,
+            'type': o.type,
+            'amount': str(o.amount),
+            'price': str(o.price),
+            'status': o.status,
+            'matches': [{
+                'id': m.id,
+                'matched_order_id': m.matched_order_id,
+                'amount': str(m.amount),
+            } for m in o.matches]
+        } for o in [order, no_client_order_id]]
+
+        self.assertEqual(expected, json.loads(self.serializer.dumps([order, no_client_order_id])))
+
+
+class FakeResponse:
+    default_content_type = 'text/html'
+
+    def __init__(self):
+        self.content_type = self.default_content_type
+        self.app_iter = None
+
+
+class FakeRequest:
+    def __init__(self):
+        self.response = FakeResponse()
+
+
+class JsonRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        serializer = JsonSerializer(chunk_size=2)
+        serializer.add_writer(OrderBookOrder, write_order_book_order)
+        self.render = JsonRenderer(serializer, stream_threshold=3)(None)
+        self.request = FakeRequest()
+
+    def test_short_lists_are_returned_as_text(self):
+        orders = [OrderBookOrder(i, 'buy', Decimal('1'), Decimal('2')) for i in range(3)]
+
+        body = self.render(orders, {'request': self.request})
+
+        self.assertEqual(3, len(json.loads(body)))
+        self.assertIsNone(self.request.response.app_iter)
+        self.assertEqual('application/json', self.request.response.content_type)
+
+    def test_long_lists_are_streamed(self):
+        orders = [OrderBookOrder(i, 'buy', Decimal('1'), Decimal('2')) for i in range(5)]
+
+        self.assertIsNone(self.render(orders, {'request': self.request}))
+
+        chunks = list(self.request.response.app_iter)
+        self.assertEqual(4, len(chunks))
+        self.assertTrue(all(isinstance(c, bytes) for c in chunks))
+        self.assertEqual(list(range(5)), [o['id'] for o in json.loads(b''.join(chunks).decode('ascii'))])
+        self.assertEqual('application/json', self.request.response.content_type)
+
+    def test_content_type_set_by_the_view_is_kept(self):
+        self.request.response.content_type = 'application/vnd.orders+json'
+
+        self.render({'status': 'success'}, {'request': self.request})
+
+        self.assertEqual('application/vnd.orders+json', self.request.response.content_type)
@@ -1,15 +1,43 @@
 import decimal
 from decimal import Decimal
 
-from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPBadRequest, HTTPConflict
 from pyramid.view import (
     view_config,
     view_defaults
 )
+from repoze.lru import LRUCache
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
+from db import Bakery
 from models import DBSession, Order, Balance
 from order_book import SharedOrderBook, OrderBookOrder
 
+# Recently used (user id, client order id) pairs, so retried requests are rejected without hitting the database.
+# The unique index on orders is the source of truth, this is only a fast path.
+RecentClientOrderIds = LRUCache(10000)
+
+# Matches are loaded with a single additional query instead of one query per order
+user_orders_query = Bakery(lambda session: session.query(Order).options(selectinload(Order.matches)))
+user_orders_query += lambda q: q.filter(Order.user_id == bindparam('user_id')).order_by(Order.id)
+
+balance_for_update_query = Bakery(lambda session: session.query(Balance))
+balance_for_update_query += lambda q: q.filter(Balance.currency == bindparam('currency')).\
+    filter(Balance.user_id == bindparam('user_id')).with_for_update()
+
+order_id_by_client_order_id_query = Bakery(lambda session: session.query(Order.id))
+order_id_by_client_order_id_query += lambda q: q.filter(Order.user_id == bindparam('user_id')).\
+    filter(Order.client_order_id == bindparam('client_order_id'))
+
+# Locking read sees orders committed by concurrent transactions, a plain read only sees the transaction snapshot
+locked_order_id_by_client_order_id_query = order_id_by_client_order_id_query + \
+    (lambda q: q.with_for_update(read=True))
+
+user_order_query = Bakery(lambda session: session.query(Order))
+user_order_query += lambda q: q.filter(Order.id == bindparam('order_id')).filter(Order.user_id == bindparam('user_id'))
+
 
 @view_defaults(renderer='json', permission='trade')
 class JsonViews:
@@ -18,21 +46,8 @@ class JsonViews:
 
     @view_config(route_name='list_orders')
     def list_orders(self):
-        orders = DBSession.query(Order).order_by(Order.id).\
-            filter(Order.user_id == self.request.user.id).\
-            all()
-        return [{
-            'id': order.id,
-            'type': order.type,
-            'amount': str(order.amount),
-            'price': str(order.price),
-            'status': order.status,
-            'matches': [{
-                'id': match.id,
-                'matched_order_id': match.matched_order_id,
-                'amount': str(match.amount),
-            } for match in order.matches]
-        } for order in orders]
+        # Orders are written directly by the renderer (see serialization.write_order)
+        return user_orders_query(DBSession()).params(user_id=self.request.user.id).all()
 
     # In practice this should prevent:
     # - negative orders
@@ -64,9 +79,22 @@ class JsonViews:
         except decimal.InvalidOperation:
             return HTTPBadRequest(detail='Invalid price parameter: {}'.format(price_str))
 
-        session = DBSession
+        # MySQL ignores trailing spaces even with a binary collation, such ids would collide on the unique index
+        client_order_id = body.get('client_order_id')
+        if client_order_id is not None and (not isinstance(client_order_id, str) or len(client_order_id) > 64
+                                            or client_order_id != client_order_id.rstrip(' ')):
+            return HTTPBadRequest(detail='Invalid client_order_id parameter: {}'.format(client_order_id))
+
+        session = DBSession()
 
-        order = Order(user_id=self.request.user.id, status='pending', type=order_type, amount=amount, price=price)
+        if client_order_id is not None:
+            existing_id = self.__existing_order_id(session, self.request.user.id, client_order_id)
+            if existing_id is not None:
+                return HTTPConflict(detail='Duplicate client_order_id: {}, order id: {}'.format(
+                    client_order_id, existing_id))
+
+        order = Order(user_id=self.request.user.id, client_order_id=client_order_id, status='pending',
+                      type=order_type, amount=amount, price=price)
 
         balance_currency = order.required_currency()
         balance = self.__balance_for_user(session, balance_currency, 1)
@@ -79,10 +107,28 @@ class JsonViews:
         if balance.amount < required_amount:
             return HTTPBadRequest(detail='Insufficient founds: {}'.format(balance.amount))
 
-        balance.amount = balance.amount - required_amount
-
-        session.add(order)
-        session.flush()
+        try:
+            # A retry that raced the original request past the duplicate check fails on the unique index, roll back
+            # to the savepoint so the balance is not charged twice
+            with session.begin_nested():
+                balance.amount = balance.amount - required_amount
+                session.add(order)
+        except IntegrityError:
+            if client_order_id is None:
+                raise
+
+            existing = locked_order_id_by_client_order_id_query(session).\
+                params(user_id=self.request.user.id, client_order_id=client_order_id).first()
+            if existing is None:
+                raise
+
+            return HTTPConflict(detail='Duplicate client_order_id: {}, order id: {}'.format(
+                client_order_id, existing.id))
+
+        if client_order_id is not None:
+            # Only cache ids of orders that were actually stored
+            self.request.tm.get().addAfterCommitHook(
+                self.__remember_client_order_id, args=((order.user_id, client_order_id), order.id))
 
         SharedOrderBook.add_order(OrderBookOrder(order.id, order.type, order.amount, order.price))
 
@@ -90,21 +136,40 @@ class JsonViews:
 
     @staticmethod
     def __balance_for_user(session, currency, user_id):
-        balance = session.query(Balance).\
-            filter(Balance.currency == currency).\
-            filter(Balance.user_id == user_id).with_for_update().first()
+        balance = balance_for_update_query(session).params(currency=currency, user_id=user_id).first()
 
         if balance is None:
             return Balance(currency=currency, amount=Decimal(0), user_id=user_id)
 
         return balance
 
+    @staticmethod
+    def __existing_order_id(session, user_id, client_order_id):
+        key = (user_id, client_order_id)
+
+        order_id = RecentClientOrderIds.get(key)
+        if order_id is not None:
+            return order_id
+
+        order = order_id_by_client_order_id_query(session).\
+            params(user_id=user_id, client_order_id=client_order_id).first()
+        if order is None:
+            return None
+
+        RecentClientOrderIds.put(key, order.id)
+        return order.id
+
+    @staticmethod
+    def __remember_client_order_id(committed, key, order_id):
+        if committed:
+            RecentClientOrderIds.put(key, order_id)
+
     @view_config(route_name='cancel_order')
     def cancel_order(self):
         order_id = self.request.matchdict['orderId']
 
         session = DBSession()
-        order = session.query(Order).filter(Order.id == order_id).filter(Order.user_id == self.request.user.id).first()
+        order = user_order_query(session).params(order_id=order_id, user_id=self.request.user.id).first()
         if order is None:
             return HTTPBadRequest(detail='Invalid order id: {}'.format(order_id))
 